@@ -2,7 +2,9 @@
 
 import cPickle as pickle
 import logging
+import marshal
 import socket
+import struct
 import threading
 import time
 
@@ -15,36 +17,161 @@ import framebuffer
 import sound
 import steering
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# every request is its length followed by the command text
+REQUEST_HEADER = struct.Struct('!I')
+
+# every response is a result code, payload codec and payload length,
+# followed by the payload
+RESPONSE_HEADER = struct.Struct('!BBI')
+RESULTS = ('ok', 'invalid', 'rejected', 'error')
+
+# decoders for the payload codecs the server may use; status values are
+# struct-packed and decoded separately
+CODEC_PICKLE = 0
+CODEC_MARSHAL = 1
+CODEC_MSGPACK = 3
+DECODERS = {CODEC_PICKLE:pickle.loads, CODEC_MARSHAL:marshal.loads}
+if msgpack is not None:
+    DECODERS[CODEC_MSGPACK] = msgpack.unpackb
+
+# the modules needed for the codecs that may be missing here
+CODEC_MODULES = {CODEC_MSGPACK:'msgpack'}
+
+# a successful status comes as its layout and values the first time, and as
+# struct-packed values only while its layout stays the same
+STATUS_LAYOUT = 4
+STATUS_VALUES = 5
+
+def build_status(layout, values):
+    """Rebuilds a status from its layout and an iterator over its values"""
+    kind, spec = layout
+    if kind == 'd':
+        return dict((key, build_status(sub, values)) for key, sub in spec)
+    elif kind == 'l':
+        return [build_status(sub, values) for sub in spec]
+    elif kind == 'v':
+        return next(values)
+    else:
+        return spec
+
 class RobotCommandError(Exception):
     """Used when a robot command cannot be executed"""
     pass
 
 class Robot(object):
     """Wraps the communication protocol with the robot server"""
+
+    # initial size of the receive buffer; it grows if a response won't fit
+    RECV_BUFFER_SIZE = 65536
+
     def __init__(self, host, port):
         """connects to the driver server"""
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((host, port))
 
-        self.server = self.sock.makefile('w')
+        # commands are tiny and latency-bound, so don't let Nagle hold them back
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # responses are received straight into this buffer; _rxused is the
+        # number of bytes in it which have not been consumed yet
+        self._rxbuf = bytearray(self.RECV_BUFFER_SIZE)
+        self._rxview = memoryview(self._rxbuf)
+        self._rxused = 0
+
+        # layout of the last status, and the struct its values are packed with
+        self._status_layout = None
+        self._status_struct = None
 
         self.disconnected = False
 
+        # ask for msgpack if we can decode it; the server answers in marshal
+        # if it wasn't started with --wire=msgpack
+        if msgpack is not None:
+            self.send_batch(['wire msgpack'])
+
+    def _fill(self, size):
+        """Receives from the server until at least size bytes are buffered"""
+        if size > len(self._rxbuf):
+            rxbuf = bytearray(size)
+            rxbuf[:self._rxused] = self._rxbuf[:self._rxused]
+            self._rxbuf, self._rxview = rxbuf, memoryview(rxbuf)
+
+        while self._rxused < size:
+            received = self.sock.recv_into(self._rxview[self._rxused:])
+            if not received:
+                raise RobotCommandError("connection closed by the server")
+            self._rxused += received
+
+    def _recv_frame(self):
+        """Reads a single response frame, returning its result code, codec and payload"""
+        #read the fixed-size header, then the payload it describes
+        self._fill(RESPONSE_HEADER.size)
+        code, codec, length = RESPONSE_HEADER.unpack_from(self._rxbuf)
+
+        end = RESPONSE_HEADER.size + length
+        self._fill(end)
+        payload = bytes(self._rxbuf[RESPONSE_HEADER.size:end])
+
+        # keep whatever we got of the next frame at the start of the buffer
+        leftover = self._rxused - end
+        if leftover:
+            self._rxbuf[:leftover] = self._rxbuf[end:self._rxused]
+        self._rxused = leftover
+
+        return code, codec, payload
+
+    def send_batch(self, commands):
+        """Sends several commands in one write, then reads all of their responses
+
+        Returns a list with the output of each command, in order; commands
+        the server did not execute have a RobotCommandError in their place.
+        """
+        frames = []
+        for command in commands:
+            command = command.strip()
+            frames.append(REQUEST_HEADER.pack(len(command)))
+            frames.append(command)
+        self.sock.sendall("".join(frames))
+
+        outputs = []
+        for command in commands:
+            code, codec, payload = self._recv_frame()
+            if code == STATUS_VALUES:
+                values = self._status_struct.unpack(payload)
+                outputs.append(build_status(self._status_layout, iter(values)))
+                continue
+
+            decoder = DECODERS.get(codec)
+            if decoder is None:
+                outputs.append(RobotCommandError("cannot decode response: the %s module is not installed"
+                    % CODEC_MODULES.get(codec, 'codec %d' % codec)))
+                continue
+
+            output = decoder(payload)
+
+            if code == STATUS_LAYOUT:
+                self._status_layout, fmt, values = output
+                self._status_struct = struct.Struct(fmt)
+                outputs.append(build_status(self._status_layout, iter(values)))
+            elif code == 0:
+                outputs.append(output)
+            else:
+                outputs.append(RobotCommandError(str((RESULTS[code], output))))
+
+        return outputs
+
     def _send_command(self, command):
         """Sends a command to the server"""
-        command = "%s\n" % (command.strip())
-        self.server.write(command)
-        self.server.flush()
+        output = self.send_batch([command])[0]
+        if isinstance(output, RobotCommandError):
+            raise output
 
-        #read the length of the result
-        length = int(self.server.readline())
-        output = self.server.read(length)
-
-        result = pickle.loads(output)
-        if result[0] == 'ok':
-            return result[1]
-        else:
-            raise RobotCommandError(str(result))
+        return output
 
     def disconnect(self):
         """Stops the motors and disconnects from the server"""
@@ -91,11 +218,18 @@ class Robot(object):
 
         return ", ".join(outputs)
 
-    def get_status(self):
+    def get_status(self, sensors = None):
+        """Gets the robot's status, with only the given sensor keys if any"""
+        if sensors:
+            return self._send_command('status %s' % ' '.join(sensors))
         return self._send_command('status')
 
 class RobotClient(object):
     """Controls the robot"""
+
+    # seconds between status requests while the user isn't doing anything
+    STATUS_PERIOD = 0.1
+
     def __init__(
             self, robot, ui, steering_model, player, allow_control = True, become_controller = False):
         self.robot = robot
@@ -108,48 +242,97 @@ class RobotClient(object):
 
         self._stop = threading.Event()
 
+        # when we last received a status from the robot
+        self._last_status_ts = 0
+
+        # handlers for each type of user command; each is passed the command
+        # and the list of robot commands to send with this tick's status request
+        self._dispatch = {
+                commands.Quit:self._handle_quit,
+                commands.Shutdown:self._handle_shutdown,
+                commands.Horn:self._handle_horn,
+                commands.Reset:lambda command, batch: self.robot.reset(),
+                commands.Go:lambda command, batch: self.robot.go(),
+                commands.Stop:lambda command, batch: self.robot.stop(),
+                commands.Brake:self._handle_motion,
+                commands.Hold:self._handle_motion,
+                commands.Drive:self._handle_motion,
+                commands.Steer:self._handle_motion,
+                }
+
+    def _handle_quit(self, command, batch):
+        self.robot.disconnect()
+        self._stop.set()
+
+    def _handle_shutdown(self, command, batch):
+        self.robot.shutdown()
+        self._stop.set()
+
+    def _handle_horn(self, command, batch):
+        if self.player:
+            self.player.play(self.player.SOUNDS['honk'])
+
+    def _handle_motion(self, command, batch):
+        new_speeds = self.steering.parse_user_command(command)
+        if 'brake' in new_speeds:
+            batch.append("brake %d" % int(new_speeds['brake']))
+        else:
+            batch.append("left %d" % int(new_speeds['left']))
+            batch.append("right %d" % int(new_speeds['right']))
+
     def run(self):
         """Main loop which drives the robot"""
         if self.become_controller:
             self.robot.become_controller()
 
-        while not self._stop.is_set():
-            user_command = self.ui.get_command()
+        # bind everything the loop uses on every tick to locals
+        Quit = commands.Quit
+        stopped = self._stop.is_set
+        get_command = self.ui.get_command
+        get_handler = self._dispatch.get
+        status_period = self.STATUS_PERIOD
+
+        while not stopped():
+            # wait for the user until the next status request is due
+            timeout = self._last_status_ts + status_period - time.time()
+            user_command = get_command(max(timeout, 0))
+
+            # commands sent to the robot along with this tick's status request
+            batch = []
 
             # if we don't allow control, then only allow quit command
-            if not self.allow_control and type(user_command) != commands.Quit:
+            if not self.allow_control and type(user_command) is not Quit:
                 user_command = None
 
-            if user_command:
+            handler = get_handler(type(user_command)) if user_command else None
+            if handler:
                 try:
-                    if type(user_command) == commands.Quit:
-                        self.robot.disconnect()
-                        break
-                    elif type(user_command) == commands.Shutdown:
-                        self.robot.shutdown()
-                        break
-                    elif type(user_command) == commands.Horn and self.player:
-                        self.player.play(self.player.SOUNDS['honk'])
-                    elif type(user_command) == commands.Reset:
-                        self.robot.reset()
-                    elif type(user_command) == commands.Go:
-                        self.robot.go()
-                    elif type(user_command) == commands.Stop:
-                        self.robot.stop()
-                    elif type(user_command) in (
-                            commands.Brake, commands.Hold, commands.Drive, commands.Steer):
-                        new_speeds = self.steering.parse_user_command(user_command)
-                        if 'brake' in new_speeds:
-                            self.robot.brake(int(new_speeds['brake']))
-                        else:
-                            self.robot.set_speed(int(new_speeds['left']), 'left')
-                            self.robot.set_speed(int(new_speeds['right']), 'right')
-
+                    handler(user_command, batch)
                 except RobotCommandError, e:
                     logging.error(str(e))
                     self.ui.error_notify(e)
 
-            status = self.robot.get_status()
+                # quit and shutdown have closed the connection
+                if stopped():
+                    break
+
+            # the steering model works from the last status, so always
+            # refresh it after moving; otherwise only poll it periodically
+            if not batch and time.time() - self._last_status_ts < status_period:
+                continue
+
+            batch.append('status')
+            outputs = self.robot.send_batch(batch)
+            status = outputs.pop()
+            self._last_status_ts = time.time()
+            if isinstance(status, RobotCommandError):
+                raise status
+
+            for output in outputs:
+                if isinstance(output, RobotCommandError):
+                    logging.error(str(output))
+                    self.ui.error_notify(output)
+
             self.ui.update_status(status)
             self.steering.update_status(status)
 
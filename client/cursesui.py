@@ -5,6 +5,13 @@ import curses
 import time
 import threading
 
+# justifies a line to a given length, by alignment
+_ALIGN = {
+        'left':str.ljust,
+        'right':str.rjust,
+        'center':str.center,
+        }
+
 class CursesUI(threading.Thread):
     """A curses UI or talking to a driver via client"""
     def __init__(self, allow_input):
@@ -20,6 +27,18 @@ class CursesUI(threading.Thread):
         # keep track of the last keystroke
         # it is cleared and returned by get_command
         self._last_key = None
+        # set when a key is pressed, to wake up get_command
+        self._key_pressed = threading.Event()
+
+        # windows which have been written to since they were last refreshed
+        self._dirty = {}
+
+        # (height, width) of each window; windows are never resized
+        self._dims = {}
+
+        # status keys padded to the width of their window, by (window, key);
+        # the status schema is fixed so these are built once per key
+        self._padded_keys = {}
 
     def init(self):
         """Sets up ncurses and creates all the windows"""
@@ -56,12 +75,18 @@ class CursesUI(threading.Thread):
         """The main loop"""
         while not self._stop.is_set():
             self.write_line(self.windows['time'], 1, "%.2f" % time.time(), align = 'center')
+
+            # stage every changed window, then draw them all in one update
             for window in self.windows.values():
-                window.refresh()
+                if self._dirty.get(window):
+                    self._dirty[window] = False
+                    window.noutrefresh()
+            curses.doupdate()
 
             if self.allow_input:
                 try:
                     self._last_key = self.stdscr.getkey()
+                    self._key_pressed.set()
                 except:
                     pass
 
@@ -75,6 +100,7 @@ class CursesUI(threading.Thread):
         """Creates a window"""
         window = curses.newwin(height, width, top, left)
 
+        self._dirty[window] = True
         if border:
             window.box()
         if title:
@@ -85,18 +111,26 @@ class CursesUI(threading.Thread):
 
     def write_key_value(self, window, linenum, key, value):
         """Properly formats and writes a key-value pair"""
-        key = str(key)
         value = str(value)
 
-        max_width = window.getmaxyx()[1] - 2 #subtract 2 for borders
-        key_len = max_width - len(value) - 1 #subtract 1 for the space between k and v
+        padded_key = self._padded_keys.get((window, key))
+        if padded_key is None:
+            max_width = window.getmaxyx()[1] - 2 #subtract 2 for borders
+            padded_key = str(key)[:max_width].ljust(max_width)
+            self._padded_keys[(window, key)] = padded_key
+
+        key_len = len(padded_key) - len(value) - 1 #subtract 1 for the space between k and v
 
-        line = "%s %s" % (key[:key_len].ljust(key_len), value)
+        line = "%s %s" % (padded_key[:max(key_len, 0)], value)
         self.write_line(window, linenum, line)
 
     def write_line(self, window, linenum, line, align = 'left', left_margin = 1, right_margin = 1, nopad = False):
         """Writes a line in the specified window"""
-        h, w = window.getmaxyx()
+        dims = self._dims.get(window)
+        if dims is None:
+            dims = self._dims[window] = window.getmaxyx()
+
+        h, w = dims
         if linenum > h:
             return
 
@@ -107,14 +141,10 @@ class CursesUI(threading.Thread):
             line = line[:w-2]
 
             # next justify the line
-            align_fun = {
-                    'left':line.ljust,
-                    'right':line.rjust,
-                    'center':line.center,
-                    }
-            line = align_fun[align](length)
+            line = _ALIGN[align](line, length)
 
         window.addstr(linenum, left_margin, line)
+        self._dirty[window] = True
 
     def write_result(self, result):
         self.write_line(self.windows['result'], 1, str(result))
@@ -145,8 +175,12 @@ class CursesUI(threading.Thread):
             self.write_key_value(self.windows['sensors'], sen_line, sen['name'], val)
             sen_line += 1
 
-    def get_command(self):
-        """Returns the user's last command"""
+    def get_command(self, timeout = None):
+        """Returns the user's last command, waiting up to timeout seconds for one"""
+        if timeout and self._last_key is None:
+            self._key_pressed.wait(timeout)
+        self._key_pressed.clear()
+
         try:
             if self._last_key == 'q':
                 return commands.Quit()
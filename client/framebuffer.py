@@ -18,8 +18,9 @@ class CursesUI(threading.Thread):
     def update_status(self, status):
         pass
 
-    def get_command(self):
-        pass
+    def get_command(self, timeout = None):
+        if timeout:
+            time.sleep(timeout)
 
     def error_notify(self, error):
         pass
@@ -25,8 +25,8 @@ class JoyrideUI(threading.Thread):
             time.sleep(0.2)
         self.js.close()
 
-    def get_command(self):
-        return self.js.get_event()
+    def get_command(self, timeout=None):
+        return self.js.get_event(timeout)
 
     def update_status(self, status):
         pass
@@ -7,7 +7,10 @@ stores them in a more usable format.
 [1] http://www.kernel.org/doc/Documentation/input/joystick-api.txt
 """
 
+import collections
 import commands
+import errno
+import os
 import select
 import struct
 import threading
@@ -18,52 +21,66 @@ class JoystickError(Exception):
     """Used to signify a joystick problem"""
     pass
 
+# Layout of an event from the joystick driver: time, value, type, number.
+_EVT = struct.Struct('=LhBB')
+
 class RawEvent(object):
-    """An event reported by the joystick driver."""
+    """Constants for the events reported by the joystick driver.
+
+    Events themselves are kept as (time, value, event_type, number) tuples
+    straight from _EVT, so no object is allocated per event.
+    """
 
     # Number of bytes per event.
-    BYTES = 8
+    BYTES = _EVT.size
 
     # Event types:
     BUTTON = 1  # Button press.
     AXIS = 2  # Movement on some axis (a delta).
     INIT = 128  # Synthetic mask for first
 
-    def __init__(self, time=0, value=0, event_type=0, number=0):
-        self.time = time
-        self.value = value
-        self.event_type = event_type
-        self.number = number
-
-    @staticmethod
-    def Unpack(data):
-        """Unpacks data from the joystick.
 
-        Args:
-            data: A string with raw joystick input.
-
-        Returns:
-            A RawEvent with decoded data.
-        """
-        time, value, event_type, number = struct.unpack('=LhBB', data)
-        return RawEvent(time=time, value=value, event_type=event_type,
-                        number=number)
+def Calibration(v_min, v_zero, v_max):
+    """Precomputes the constants Normalize needs for an axis.
 
-    def __repr__(self):
-        return 'RawEvent(time=%d, value=%d, event_type=%d, number=%d)' % (
-                self.time, self.value, self.event_type, self.number)
+    Returns:
+        A (v_zero, 1/negative range, 1/positive range) tuple. An empty range
+        gets a reciprocal of 0, so that side always normalizes to 0.
+    """
+    def reciprocal(extent):
+        return 1.0 / abs(extent) if extent else 0.0
+    return (v_zero, reciprocal(v_min - v_zero), reciprocal(v_max - v_zero))
 
 
 def Normalize(v, calibration):
     """Normalizes v to a value between -1 and 1."""
-    v_min, v_zero, v_max = calibration
+    v_zero, inv_neg, inv_pos = calibration
+    d = v - v_zero
     # Maybe use a quadratic bezier curve here or something instead.
-    if v < v_zero:
+    if d < 0:
         # -1.0 at v_min approaching 0 at v_zero.
-        return max(-1.0, -float(abs(v - v_zero)) / float(abs(v_min - v_zero)))
+        return max(-1.0, d * inv_neg)
     else:
         # 0 at v_zero and 1.0 at v_max.
-        return min(1.0, float(abs(v - v_zero)) / float(abs(v_max - v_zero)))
+        return min(1.0, d * inv_pos)
+
+
+def ButtonHandler(pressed, released):
+    """Returns a function giving the command for a button value.
+
+    The commands carry no state, so the same instances are handed out for
+    every event.
+    """
+    def handle(value):
+        return pressed if value else released
+    return handle
+
+
+def AxisHandler(command, calibration):
+    """Returns a function building the command for an axis value."""
+    def handle(value):
+        return command(Normalize(value, calibration))
+    return handle
 
 
 class Profile(object):
@@ -89,28 +106,41 @@ class Profile(object):
             go_button: The button that starts the penguin.
         """
         self.steering_axis = steering_axis
-        self.steering = (left, center, right)
+        self.steering = Calibration(left, center, right)
         self.drive_axis = drive_axis
-        self.drive = (forward, still, reverse)
+        self.drive = Calibration(forward, still, reverse)
         self.stop_button = stop_button
         self.horn_button = horn_button
         self.go_button = go_button
 
+        # Maps (event type, number) to the handler for that button or axis, so
+        # interpreting an event is a single lookup. Init events have the INIT
+        # bit set in their type, so they never match and are ignored.
+        self.handlers = {}
+        for number in set((stop_button, horn_button, go_button)):
+            if number < 0:
+                continue
+            if number == stop_button:
+                pressed = commands.Stop()
+            elif number == horn_button:
+                pressed = commands.Horn()
+            else:
+                pressed = None
+            released = commands.Go() if number == go_button else None
+            self.handlers[(RawEvent.BUTTON, number)] = ButtonHandler(pressed, released)
+
+        # Steering wins if both are on the same axis.
+        if drive_axis >= 0:
+            self.handlers[(RawEvent.AXIS, drive_axis)] = AxisHandler(commands.Drive, self.drive)
+        if steering_axis >= 0:
+            self.handlers[(RawEvent.AXIS, steering_axis)] = AxisHandler(commands.Steer, self.steering)
+
     def interpret(self, event):
-        """Interprets a raw event as a comand."""
-        # Ignore init events.
-        if event.event_type == RawEvent.BUTTON:
-            if event.number == self.stop_button and event.value:
-                return commands.Stop()
-            elif event.number == self.horn_button and event.value:
-                return commands.Horn()
-            elif event.number == self.go_button and not event.value:
-                return commands.Go()
-        elif event.event_type == RawEvent.AXIS:
-            if event.number == self.steering_axis:
-                return commands.Steer(Normalize(event.value, self.steering))
-            elif event.number == self.drive_axis:
-                return commands.Drive(Normalize(event.value, self.drive))
+        """Interprets a raw event tuple as a comand."""
+        time, value, event_type, number = event
+        handler = self.handlers.get((event_type, number))
+        if handler:
+            return handler(value)
 
 
 class NESController(Profile):
@@ -129,39 +159,59 @@ class Listener(threading.Thread):
     def __init__(self, device_path):
         threading.Thread.__init__(self, name='joystick-listener')
         self.setDaemon(True)
-        self.device = open(device_path, 'rb', 0)
-        self.events_lock = threading.Lock()
-        self.last_event = None
+        self.device = os.open(device_path, os.O_RDONLY)
+        # stop() writes to this pipe to wake the listener out of select.
+        self._wake_r, self._wake_w = os.pipe()
+        # Holds only the latest event; append and popleft are atomic, so no
+        # lock is needed between the listener and get_event.
+        self.events = collections.deque(maxlen=1)
+        # Set when an event arrives, to wake up get_event.
+        self.event_ready = threading.Event()
         self._stop = threading.Event()
 
     def stop(self):
         """Signals that the listener thread should stop."""
-        self._stop.set()
+        if not self._stop.isSet():
+            self._stop.set()
+            try:
+                os.write(self._wake_w, 'x')
+            except OSError, e:
+                # The listener already died (say, the joystick was
+                # unplugged) and closed the read end; nothing to wake.
+                if e.errno != errno.EPIPE:
+                    raise
+            os.close(self._wake_w)
 
     def run(self):
         """Listens for and queues joystick events."""
-        while not self._stop.isSet():
-            rlist, _, _ = select.select([self.device], [], [], 0.05)
-            if not rlist:
-                # Spin to check for stop signal.
-                continue
+        try:
+            while not self._stop.isSet():
+                # Block until there is an event or we are told to stop.
+                rlist, _, _ = select.select([self.device, self._wake_r], [], [])
+                if self.device not in rlist:
+                    continue
+
+                data = os.read(self.device, RawEvent.BYTES)
+                self.events.append(_EVT.unpack_from(data))
+                self.event_ready.set()
+        finally:
+            os.close(self.device)
+            os.close(self._wake_r)
 
-            data = self.device.read(RawEvent.BYTES)
-            event = RawEvent.Unpack(data)
-            self.events_lock.acquire()
-            self.last_event = event
-            self.events_lock.release()
-        self.device.close()
+    def get_event(self, timeout=None):
+        """Pops and returns the latest event, or None if there is none.
+
+        Args:
+            timeout: Seconds to wait for an event if none is pending.
+        """
+        if timeout and not self.events:
+            self.event_ready.wait(timeout)
+        self.event_ready.clear()
 
-    def get_event(self):
-        """Pops and returns the oldest queued event."""
-        self.events_lock.acquire()
         try:
-            event = self.last_event
-            self.last_event = None
-            return event
-        finally:
-            self.events_lock.release()
+            return self.events.popleft()
+        except IndexError:
+            return None
 
 
 class Joystick(object):
@@ -175,18 +225,22 @@ class Joystick(object):
             profile: The profile to use to interpret raw events.
 
         Raises:
-            IOError: If the device could not be opened.
+            OSError: If the device could not be opened.
         """
         self.listener = Listener(device_path)
         self.listener.start()
         self.profile = profile
 
-    def get_event(self):
-        """Returns True iff the joystick has pending events."""
+    def get_event(self, timeout=None):
+        """Returns the command for the latest event, if there is one.
+
+        Args:
+            timeout: Seconds to wait for an event if none is pending.
+        """
         if not self.listener.is_alive():
             raise JoystickError("listener has terminated")
 
-        event = self.listener.get_event()
+        event = self.listener.get_event(timeout)
         if event:
             return self.profile.interpret(event)
 
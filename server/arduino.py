@@ -247,6 +247,13 @@ class Arduino(object):
 
             # update the new sensor readings
             for sensor_name, sensor_data in sensors.items():
+                # convert once here so the sensors don't on every read;
+                # readings that aren't a single integer stay as sent
+                try:
+                    sensor_data = int(sensor_data)
+                except ValueError:
+                    pass
+
                 reading = SensorReading(timestamp, sensor_name, sensor_data)
                 self.sensor_readings[sensor_name] = reading
 
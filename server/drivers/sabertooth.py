@@ -6,6 +6,9 @@ import time
 
 from parameters import driver as dp
 
+# sabertooth speed for each whole speed from -100 to 100, indexed by speed + 100
+SPEED_TABLE = tuple(speed * 63 / 100 for speed in range(-100, 101))
+
 class SabertoothDriver(object):
     """A driver which controls motors via the Sabertooth 2x60 Motor Controller"""
     def __init__(self, robot,
@@ -29,6 +32,11 @@ class SabertoothDriver(object):
                 self.validate_parameter('Left speed adjustment', left_speed_adjust, 0, 1),
                 self.validate_parameter('Right speed adjustment', right_speed_adjust, 0, 1))
 
+        # combined adjustment applied to each side's speed before it is sent
+        self.output_scale = (
+                self.side_adjust[0] * self.speed_adjust,
+                self.side_adjust[1] * self.speed_adjust)
+
         # controls maximum frequency with which update_speed runs
         self.last_speed_update = 0  # last time speed was updated
         self.min_update_interval = min_update_interval
@@ -38,6 +46,7 @@ class SabertoothDriver(object):
 
         self.target_speeds = [0, 0] # target speed (set by calls to set_speed)
         self.last_speeds = [0, 0]   # last speed sent to motor controller (before adjust)
+        self.last_frame = None      # last (right, left) velocity frame the arduino accepted
 
     def validate_parameter(self, name, value, minimum, maximum):
         if value >= minimum and value <= maximum: return value
@@ -48,17 +57,21 @@ class SabertoothDriver(object):
         if speed > 100 or speed < -100:
             raise common.DriverError("Speed outside the allowed range")
 
+        if type(speed) is int:
+            return SPEED_TABLE[speed + 100]
         return int(speed * 63 / 100)
 
     ###### the interface of the driver #####
     def go(self):
         """Puts the controller into a basic run state"""
         self.brake(self.max_braking)
+        self.last_frame = None
         self.robot.arduino.send_command('G')
 
     def stop(self):
         """Stops the robot"""
         self.robot.arduino.send_command('X')
+        self.last_frame = None
         self.target_speeds = [0, 0]
 
     def brake(self, speed):
@@ -109,52 +122,56 @@ class SabertoothDriver(object):
 
         # make a copy of the target spees to avoid race conditions
         target_speeds = list(self.target_speeds)
+        last_speeds = self.last_speeds
 
         # figure out what we're going to send this time around
-        to_send = list(target_speeds)
+        to_send = [0, 0]
         for i in (0, 1):
             # what is our maximum acceleration speed?
             # if we're actively braking, we can change at up to brake speed
             # never use braking to accelerate though; in that case, use
             # normal acceleration model
-            if self.braking_speed and abs(target_speeds[i]) < abs(self.last_speeds[i]):
+            if self.braking_speed and abs(target_speeds[i]) < abs(last_speeds[i]):
                 max_diff = self.braking_speed
             # otherwise we're accelerating/decellerating normally
             else:
                 max_diff = self.max_acceleration
 
             # avoid accelerating more than the max acceleration
-            diff = target_speeds[i] - self.last_speeds[i]
+            diff = target_speeds[i] - last_speeds[i]
             if abs(diff) > max_diff:
                 diff = copysign(max_diff, diff)
 
             # figure out new speed to send
-            self.last_speeds[i] = self.last_speeds[i] + diff
+            last_speeds[i] = last_speeds[i] + diff
 
             # send adjusted parameters
-            to_send[i] = self.last_speeds[i] * self.side_adjust[i] * self.speed_adjust
+            to_send[i] = last_speeds[i] * self.output_scale[i]
 
-        # if our speed is too slow, send 0 but claim target has been reached
-        for i in (0,1):
+            # if our speed is too slow, send 0 but claim target has been reached
             if abs(to_send[i]) < self.min_speed:
-                self.last_speeds[i] = target_speeds[i]
+                last_speeds[i] = target_speeds[i]
                 to_send[i] = 0
 
         # sabertooth takes right,left instead of left-right like everything else here
-        self.robot.arduino.send_command('V%d,%d' % (
-            self._convert_speed(to_send[1]),
-            self._convert_speed(to_send[0])))
+        frame = (self._convert_speed(to_send[1]), self._convert_speed(to_send[0]))
+
+        # don't repeat a frame the arduino already has; go and stop reset it
+        if frame != self.last_frame and self.robot.arduino.send_command('V%d,%d' % frame):
+            self.last_frame = frame
 
         self.last_speed_update = time.time()
 
     @property
     def status(self):
+        # the last speeds swap between int and float while ramping, so
+        # always report them as floats to keep the status layout stable
         return {
                 'target left':self.target_speeds[0],
                 'target right':self.target_speeds[1],
-                'last left':self.last_speeds[0],
-                'last right':self.last_speeds[1],
-                'last speed update':self.last_speed_update,
+                'last left':float(self.last_speeds[0]),
+                'last right':float(self.last_speeds[1]),
+                'last speed update':float(self.last_speed_update),
                 'braking speed':self.braking_speed,
                 }
 
@@ -122,8 +122,7 @@ class ServerMonitor(threading.Thread):
         # Run until told to stop.
         while not self._stop.isSet():
             try:
-                for sensor in self.robot.sensors.values():
-                    sensor.read()
+                self.robot.read_sensors()
 
                 self.safety_checker.check(self.robot.sensors)
                 if self.safety_checker.should_estop():
@@ -186,6 +185,9 @@ class ServerMonitor(threading.Thread):
                 # send new robot speed
                 self.robot.driver.update_speed()
 
+                # publish the status the clients will be handed
+                self.robot.refresh_status()
+
                 time.sleep(mp['loop_min_interval'])
 
             except serial.SerialException:
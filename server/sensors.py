@@ -1,6 +1,8 @@
 #!/usr/bin/python
 
 import time
+from array import array
+from bisect import bisect_right
 from collections import deque
 
 class Sensor(object):
@@ -9,27 +11,38 @@ class Sensor(object):
 
 class ArduinoConnectedSensor(Sensor):
     """A sensor connected to the on-board arduino on the robot"""
-    def __init__(self, robot, key):
+    units = None
+
+    def __init__(self, robot, key, name = None):
         Sensor.__init__(self)
 
         self.robot = robot
         self.key = key
+        self.name = name
+
+        # reused by every status; only the value changes between calls
+        self._status = {'value':None, 'units':self.units, 'name':name}
 
-    def _read(self):
-        try:
-            reading = self.robot.arduino.sensor_readings[self.key]
-            return reading
-        except KeyError:
-            return None
+    def _read(self, readings = None):
+        """Returns this sensor's latest reading, from readings if given"""
+        if readings is None:
+            readings = self.robot.arduino.sensor_readings
+
+        return readings.get(self.key)
 
 class VoltageSensor(ArduinoConnectedSensor):
     """An analog sensor for determining voltage; uses a voltage divider on the arduino"""
-    def __init__(self, robot, key, R1 = 1, R2 = 1):
-        ArduinoConnectedSensor.__init__(self, robot, key)
+    units = 'mV'
+
+    def __init__(self, robot, key, R1 = 1, R2 = 1, name = None):
+        ArduinoConnectedSensor.__init__(self, robot, key, name)
 
         # resistors used on the divider, in ohms
         self.ratio = float(R1 + R2) / float(R2)
 
+        # scales a raw 10-bit reading of the 5V reference to divider input
+        self._scale = self.ratio * 5 / 1023.0
+
         self.readings = deque([0] * 20, 20)
 
     @property
@@ -37,11 +50,11 @@ class VoltageSensor(ArduinoConnectedSensor):
         """Voltage is actually an average of several readings"""
         return sum(self.readings)/len(self.readings)
 
-    def read(self):
+    def read(self, readings = None, now = None):
         """reads the raw millivolt value from the arduino and scales it by the voltage divider ratio"""
-        reading = self._read()
+        reading = self._read(readings)
         if reading is not None:
-            voltage = self.ratio * float(reading.data) * 5 / 1023
+            voltage = self._scale * reading.data
             self.readings.popleft()
             self.readings.append(voltage)
 
@@ -49,14 +62,26 @@ class VoltageSensor(ArduinoConnectedSensor):
 
     @property
     def status(self):
-        return {'value':self.voltage, 'units':'mV'}
+        self._status['value'] = self.voltage
+        return self._status
 
 class TemperatureSensor(ArduinoConnectedSensor):
     """A TMP36 connected to the arduino"""
-    def __init__(self, robot, key, scaling_function = lambda voltage: (voltage - 500) / 10):
-        ArduinoConnectedSensor.__init__(self, robot, key)
+    units = 'C'
+
+    def __init__(self, robot, key, scaling_function = None, name = None):
+        """scaling_function maps millivolts to degrees; None uses the TMP36 curve"""
+        ArduinoConnectedSensor.__init__(self, robot, key, name)
         self.scaling_function = scaling_function
 
+        # scales a raw 10-bit reading of the 5V reference to millivolts
+        self._mv_scale = 5000.0 / 1023
+        self._tmp36 = scaling_function is None
+
+        # the TMP36 gives 10mV per degree with a 500mV offset, which folds
+        # into the reading scale as degrees = raw * scale - 50
+        self._tmp36_scale = self._mv_scale * 0.1
+
         self.readings = deque([0]*20, 20)
 
     @property
@@ -64,11 +89,13 @@ class TemperatureSensor(ArduinoConnectedSensor):
         """Temperature is actually an average of the last X readings"""
         return sum(self.readings)/len(self.readings)
 
-    def read(self):
-        reading = self._read()
+    def read(self, readings = None, now = None):
+        reading = self._read(readings)
         if reading is not None:
-            mV = float(reading.data) * (5.0 / 1023) * 1000
-            temperature = self.scaling_function(mV)
+            if self._tmp36:
+                temperature = reading.data * self._tmp36_scale - 50
+            else:
+                temperature = self.scaling_function(reading.data * self._mv_scale)
             self.readings.popleft()
             self.readings.append(temperature)
 
@@ -76,54 +103,52 @@ class TemperatureSensor(ArduinoConnectedSensor):
 
     @property
     def status(self):
-        return {'value':self.temperature, 'units':'C'}
+        self._status['value'] = self.temperature
+        return self._status
 
 class Sonar(ArduinoConnectedSensor):
     """An LV-MaxSonar -EZ1 connected to the Arduino (via PWM)"""
-    def __init__(self, robot, key):
-        ArduinoConnectedSensor.__init__(self, robot, key)
+    units = '"'
 
-    def read(self):
-        reading = self._read()
+    def __init__(self, robot, key, name = None):
+        ArduinoConnectedSensor.__init__(self, robot, key, name)
+
+    def read(self, readings = None, now = None):
+        reading = self._read(readings)
         if reading is None:
             self.distance = None
         else:
-            self.distance = int(reading.data)
+            self.distance = reading.data
 
         return self.distance
 
     @property
     def status(self):
-        return {'value':self.distance, 'units':'"'}
+        self._status['value'] = self.distance
+        return self._status
 
 class Encoder(ArduinoConnectedSensor):
     """A magnetic encoder reading the wheel speed via a hall effect sensor"""
-    def __init__(self, robot, key, magnets = 2, min_interval = 2):
-        ArduinoConnectedSensor.__init__(self, robot, key)
+    units = 'RPM'
+
+    def __init__(self, robot, key, magnets = 2, min_interval = 2, name = None):
+        ArduinoConnectedSensor.__init__(self, robot, key, name)
 
         self.magnets = float(magnets)
         self.min_interval = min_interval
 
-        self.readings = []
-
-    @property
-    def rpm(self):
-        try:
-            first, last = (self.readings[0], self.readings[-1])
-        except:
-            first, last = (None, None)
+        # turns pulses per second into revolutions per minute
+        self._rpm_scale = 60.0 / self.magnets
+        self.rpm = 0.0
 
-        if first is None or last is None or first == last:
-            return 0
+        # pulse counts in timestamp order, with their timestamps kept in a
+        # parallel array so stale ones can be found by bisection
+        self.readings = deque()
+        self._timestamps = array('d')
 
-        interval = first.timestamp - last.timestamp
-        pulses = int(first.data) - int(last.data)
-        rpms = (float(pulses) / self.magnets) * (60.0 / interval)
-        return rpms
-
-    def read(self):
+    def read(self, readings = None, now = None):
         """Process the RPMs of the encoder"""
-        reading = self._read()
+        reading = self._read(readings)
 
         # do we add this new reading to the list?
         # ignore null readings
@@ -132,35 +157,54 @@ class Encoder(ArduinoConnectedSensor):
 
         # always add if we have nothing else
         elif len(self.readings) == 0:
-            self.readings.append(reading)
+            self.readings.append(reading.data)
+            self._timestamps.append(reading.timestamp)
 
-        # don't double-add
-        elif reading.timestamp == self.readings[-1].timestamp:
+        # don't double-add, and keep the timestamps sorted
+        elif reading.timestamp <= self._timestamps[-1]:
             pass
 
         # finally, add remaining readings
         else:
-            self.readings.append(reading)
+            self.readings.append(reading.data)
+            self._timestamps.append(reading.timestamp)
 
 
         # now prune old readings
-        now = time.time()
-        pruned = [r for r in self.readings if (now - r.timestamp) < self.min_interval]
-        self.readings = pruned
+        if now is None:
+            now = time.time()
+
+        stale = bisect_right(self._timestamps, now - self.min_interval)
+        if stale:
+            del self._timestamps[:stale]
+            for i in xrange(stale):
+                self.readings.popleft()
+
+        # timestamps only move forward, so elapsed is always positive
+        if len(self.readings) < 2:
+            self.rpm = 0.0
+        else:
+            elapsed = self._timestamps[-1] - self._timestamps[0]
+            pulses = self.readings[-1] - self.readings[0]
+            self.rpm = pulses * self._rpm_scale / elapsed
 
         return self.rpm
 
     @property
     def status(self):
-        return {'value':self.rpm, 'units':'RPM'}
+        self._status['value'] = self.rpm
+        return self._status
 
 class SensorReading(object):
     """Represents a reading from a sensor attached to the arduino"""
+    __slots__ = ('timestamp', 'sensor_name', 'data')
+
     def __init__(self,
-            timestamp = time.time(),
+            timestamp = None,
             sensor_name = '',
             data = None):
-        self.timestamp = timestamp
+        # a default of time.time() would be evaluated only once, at import
+        self.timestamp = time.time() if timestamp is None else timestamp
         self.sensor_name = sensor_name
         self.data = data
 
@@ -1,11 +1,14 @@
 #!/usr/bin/python
 
-import SocketServer
 import cPickle as pickle
+import errno
+import marshal
+import select
+import socket
+import struct
 import sys
 import time
 import threading
-import traceback
 
 from optparse import OptionParser, OptionGroup
 
@@ -15,180 +18,477 @@ import logging
 import monitor
 import sensors
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s server %(levelname)-8s %(message)s',
                     datefmt='%m-%d %H:%M:%S')
 
+# every request is its length followed by the command text
+REQUEST_HEADER = struct.Struct('!I')
+
+# every response is a result code, payload codec and payload length,
+# followed by the payload
+RESPONSE_HEADER = struct.Struct('!BBI')
+RESULT_CODES = {'ok':0, 'invalid':1, 'rejected':2, 'error':3}
+
+# payload codecs; marshal (or msgpack, if the server was started with
+# --wire=msgpack) is used whenever the payload only holds builtin types,
+# with pickle as the fallback
+CODEC_PICKLE = 0
+CODEC_MARSHAL = 1
+CODEC_STRUCT = 2
+CODEC_MSGPACK = 3
+
+def encode(output, use_msgpack = False):
+    """Encodes a payload, returning the codec used and the encoded data"""
+    try:
+        if use_msgpack:
+            return CODEC_MSGPACK, msgpack.packb(output, use_bin_type = True)
+        return CODEC_MARSHAL, marshal.dumps(output)
+    except (ValueError, TypeError):
+        return CODEC_PICKLE, pickle.dumps(output, pickle.HIGHEST_PROTOCOL)
+
+def response(result, output):
+    """Builds a whole response frame, for outputs that never change"""
+    codec, data = encode(output)
+    return RESPONSE_HEADER.pack(RESULT_CODES[result], codec, len(data)) + data
+
+# a successful status is sent as its layout and values the first time, and
+# as struct-packed values only while its layout stays the same
+STATUS_LAYOUT = 4
+STATUS_VALUES = 5
+STATUS_TYPECODES = {bool:'?', int:'q', long:'q', float:'d'}
+
+def status_layout(status, values):
+    """Splits a status into a comparable layout and its numeric values
+
+    Numeric values are appended to values, in the order the client reads
+    them back; everything else (names, units, None) is part of the layout.
+    Numeric leaves keep their struct typecode, so a value changing type
+    (an int RPM becoming a float) changes the layout instead of being
+    packed with the old code.
+    """
+    if isinstance(status, dict):
+        return ('d', tuple([(key, status_layout(status[key], values)) for key in sorted(status)]))
+    elif isinstance(status, list):
+        return ('l', tuple([status_layout(item, values) for item in status]))
+    elif type(status) in STATUS_TYPECODES:
+        values.append(status)
+        return ('v', STATUS_TYPECODES[type(status)])
+    else:
+        return ('c', status)
+
+# the motors that can be driven on their own
+MOTORS = frozenset(('left', 'right'))
+
 class CommandError(ValueError):
     pass
 
-class TCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
-    # Bind to our port even if it's in TIME_WAIT, so we can restart the
-    # server right away.
-    allow_reuse_address = True
-    # Don't wait for all threads before dying, just die.
-    daemon_threads = True
+class TCPServer(object):
+    """Serves every client connection from a single thread, using select
+
+    Commands only take microseconds to run, so multiplexing the connections
+    is cheaper than giving each one its own thread.
+    """
+    # how many bytes to read off a connection at a time
+    RECV_SIZE = 65536
 
     def __init__(self, sockaddr, handler):
-        SocketServer.TCPServer.__init__(self, sockaddr, handler)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Bind to our port even if it's in TIME_WAIT, so we can restart the
+        # server right away.
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(sockaddr)
+        self.socket.listen(5)
+        self.server_address = self.socket.getsockname()
+
+        self.handler = handler
+        self.connections = []
         self.is_shutting_down = threading.Event()
 
+        # the connection controlling the robot, if any
+        self.controller = None
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def serve_forever(self, poll_interval = 0.5):
+        """Handles requests until shutdown() is called"""
+        try:
+            while not self.is_shutting_down.is_set():
+                waiting = [connection for connection in self.connections if connection.outgoing]
+                readable, writable, _ = select.select(
+                        [self] + self.connections, waiting, [], poll_interval)
+
+                for ready in writable:
+                    if ready in self.connections:
+                        self.service(ready, ready.handle_write)
+
+                for ready in readable:
+                    if ready is self:
+                        self.accept()
+                    elif ready in self.connections:
+                        self.service(ready, ready.handle_read)
+        finally:
+            for connection in self.connections[:]:
+                connection.close()
+            self.socket.close()
+
+    def service(self, connection, handle):
+        """Runs a connection's handler, so that its errors only close it"""
+        try:
+            handle()
+        except Exception:
+            logging.exception("Unexpected error handling %s:%s", *connection.client_address)
+            if connection in self.connections:
+                connection.close()
+
+    def accept(self):
+        try:
+            request, client_address = self.socket.accept()
+        except socket.error:
+            return
+
+        try:
+            self.connections.append(self.handler(request, client_address, self))
+        except socket.error:
+            # the client probably hung up right after connecting
+            logging.exception("Could not set up connection from %s:%s", *client_address)
+            request.close()
+
     def shutdown(self):
-        if not self.is_shutting_down.is_set():
-            self.is_shutting_down.set()
-            SocketServer.TCPServer.shutdown(self)
+        self.is_shutting_down.set()
+
+class ConnectionHandler(object):
+    """Handles the requests of a single client connection"""
+    # responses to the meta commands, built once
+    RESPONSE_EMPTY = response('ok', '')
+    RESPONSE_EXIT = response('ok', 'done')
+    RESPONSE_SHUTDOWN = response('ok', 'shutdown')
+    RESPONSE_WAS_CONTROLLER = response('ok', 'was already a controller')
+    RESPONSE_CONTROLLER = response('ok', 'acquired control lock')
+    RESPONSE_NOT_CONTROLLER = response('error', 'cannot acquire control lock')
+
+    # sent by clients to say which codec they can decode
+    WIRE_COMMANDS = frozenset(('wire marshal', 'wire msgpack'))
+
+    # size of the kernel send buffer on each connection
+    SEND_BUFFER_SIZE = 65536
+
+    # a client with this many bytes of responses queued isn't reading them
+    MAX_OUTGOING = 1 << 20
+
+    def __init__(self, request, client_address, server):
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+
+        # every response is a single small write the client is waiting on,
+        # so don't let Nagle hold it back; leave room for a few statuses
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.SEND_BUFFER_SIZE)
+
+        # a client that stops reading must not stall everybody else
+        self.request.setblocking(0)
+
+        logging.info("Client %s:%s connected", *self.client_address)
+        self.controller = False
+
+        # bytes received that don't make up a whole request yet
+        self.buffer = bytearray()
+
+        # responses the socket couldn't take yet
+        self.outgoing = bytearray()
+
+        # the last status layout sent to this client
+        self.status_layout = None
+        self.status_struct = None
+
+        # responses are in marshal unless the client asks for msgpack
+        self.use_msgpack = False
+
+    def fileno(self):
+        return self.request.fileno()
 
-class ConnectionHandler(SocketServer.StreamRequestHandler):
     def parse_speed(self, parts):
         "parses the speed that comes over the wire into an int or None"
-        try:
-            new_speed = parts[1]
-        except:
+        if len(parts) < 2:
             return None
-        else:
-            return int(new_speed)
+
+        # like split() did, ignore anything after the first argument
+        return int(parts[1].split(None, 1)[0])
+
+    def send(self, data):
+        """Sends data to the client, queueing whatever the socket won't take"""
+        if not self.outgoing:
+            try:
+                sent = self.request.send(data)
+            except socket.error, e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                sent = 0
+
+            if sent == len(data):
+                return
+            data = buffer(data, sent)
+
+        self.outgoing.extend(data)
+        if len(self.outgoing) > self.MAX_OUTGOING:
+            raise socket.error("%s:%s isn't reading its responses" % self.client_address)
+
+    def send_frame(self, code, codec, data):
+        """Sends a single response frame to the client"""
+        self.send(RESPONSE_HEADER.pack(code, codec, len(data)) + data)
 
     def send_output(self, result, output):
         """Sends the output of the request to the client"""
-        data = pickle.dumps((result, output))
-        self.wfile.write('%d\n' % len(data))
-        self.wfile.write(data)
-        self.wfile.flush()
+        codec, data = encode(output, self.use_msgpack)
+        self.send_frame(RESULT_CODES[result], codec, data)
+
+    def send_status(self, status):
+        """Sends a status, as packed values only if the client has its layout"""
+        values = []
+        layout = status_layout(status, values)
+
+        if layout == self.status_layout:
+            self.send_frame(STATUS_VALUES, CODEC_STRUCT, self.status_struct.pack(*values))
+        else:
+            fmt = '!' + ''.join([STATUS_TYPECODES[type(v)] for v in values])
+            self.status_layout = layout
+            self.status_struct = struct.Struct(fmt)
+
+            codec, data = encode((layout, fmt, values), self.use_msgpack)
+            self.send_frame(STATUS_LAYOUT, codec, data)
+
+    def do_status(self, parts, robot):
+        # the robot's status is shared, so add the monitor to a copy
+        status = dict(robot.status)
+        status['monitor'] = self.server.monitor.status
+
+        # 'status BV DT' only sends the sensors with those keys
+        if len(parts) > 1 and parts[1] != 'all':
+            try:
+                names = frozenset([robot.sensor_keys[key] for key in parts[1].split()])
+            except KeyError, e:
+                raise CommandError("unknown sensor %s" % e)
+
+            status['sensors'] = [sensor for sensor in status['sensors'] if sensor['name'] in names]
+
+        return status
+
+    def do_stop(self, parts, robot):
+        robot.stop()
+        return 'robot stopped'
+
+    def do_brake(self, parts, robot):
+        try:
+            new_speed = self.parse_speed(parts)
+            if new_speed < 1 or new_speed > 100:
+                raise ValueError("out of range")
+        except:
+            raise CommandError("brake must be a number from 1 to 100")
+
+        robot.brake(new_speed)
+        return 'braking initiated'
+
+    def do_reset(self, parts, robot):
+        robot.reset()
+        return "robot reset successful"
+
+    def do_go(self, parts, robot):
+        robot.go()
+        return "robot ready to run"
+
+    def do_speed(self, parts, robot):
+        #try to get a number out of parts[1]
+        try:
+            new_speed = self.parse_speed(parts)
+            if new_speed is None or new_speed < -100 or new_speed > 100:
+                raise ValueError("out of range")
+        except Exception, e:
+            raise CommandError("speed must be a number from -100 to 100, %s" % e)
+
+        #figure out which motor(s) we want to deal with
+        motor = parts[0] if parts[0] in MOTORS else 'both'
+        robot.set_speed(new_speed, motor)
+
+        printable_motor = "%s motor" if motor in MOTORS else "both motors"
+        return "speed on %s set to %s" % (printable_motor, new_speed)
+
+    # maps each command to the method that runs it
+    COMMANDS = {
+            'status':do_status,
+            'stop':do_stop,
+            'brake':do_brake,
+            'reset':do_reset,
+            'go':do_go,
+            'speed':do_speed,
+            'left':do_speed,
+            'right':do_speed,
+            }
+
+    # commands that drive the robot, and so need the control lock
+    CONTROL_COMMANDS = frozenset(('stop', 'brake', 'reset', 'go', 'speed', 'left', 'right'))
 
     def process_command(self, command):
         """Processes a command from the client and returns the correct output"""
         robot = self.server.robot
 
-        parts = command.split()
+        # the name, and the rest of the command as one argument
+        parts = command.split(None, 1)
 
-        if parts[0] not in (
-                'status', 'stop', 'brake', 'reset', 'go', 'speed', 'left', 'right'):
+        handler = self.COMMANDS.get(parts[0])
+        if handler is None:
             raise CommandError("invalid command '%s'" % command)
 
+        if parts[0] not in self.CONTROL_COMMANDS:
+            return handler(self, parts, robot)
 
-        if parts[0] == 'status':
-            status = robot.status
-            status['monitor'] = self.server.monitor.status
+        # the controller never needs to look at the server
+        if not self.controller and self.server.controller is not None:
+            raise Exception("another connection is controlling the robot")
 
-            output = status
+        return handler(self, parts, robot)
 
-        else:
-            acquired = self.server.control_lock.acquire(blocking = 0)
-            if not acquired:
-                raise Exception("another connection is controlling the robot")
+    def handle_write(self):
+        """Sends as many of the queued responses as the socket will take"""
+        try:
+            sent = self.request.send(self.outgoing)
+        except socket.error, e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.close()
+            return
 
-            try:
-                if parts[0] == 'stop':
-                    robot.stop()
-                    output = 'robot stopped'
-
-                elif parts[0] == 'brake':
-                    try:
-                        new_speed = self.parse_speed(parts)
-                        if new_speed < 1 or new_speed > 100:
-                            raise ValueError("out of range")
-                    except:
-                        raise CommandError("brake must be a number from 1 to 100")
-
-                    robot.brake(new_speed)
-                    output = 'braking initiated'
-
-                elif parts[0] == 'reset':
-                    robot.reset()
-                    output = "robot reset successful"
-
-                elif parts[0] == 'go':
-                    robot.go()
-                    output = "robot ready to run"
-
-                elif parts[0] in ('speed', 'left', 'right'):
-                    #try to get a number out of parts[1]
-                    try:
-                        new_speed = self.parse_speed(parts)
-                        if new_speed is None or new_speed < -100 or new_speed > 100:
-                            raise ValueError("out of range")
-                    except Exception, e:
-                        raise CommandError("speed must be a number from -100 to 100, %s" % e)
-
-                    #figure out which motor(s) we want to deal with
-                    motor = parts[0] if parts[0] in ('left', 'right') else 'both'
-                    robot.set_speed(new_speed, motor)
-
-                    printable_motor = "%s motor" if motor in ('left', 'right') else "both motors"
-                    output = "speed on %s set to %s" % (printable_motor, new_speed)
-            finally:
-                self.server.control_lock.release()
-
-        return output
-
-    def handle(self):
-        """handles a single client connection"""
-        print "Client %s:%s connected" % self.client_address
-        self.controller = False
+        del self.outgoing[:sent]
 
+    def handle_read(self):
+        """Reads what the client sent, and handles every whole request in it"""
         try:
-            while not self.server.is_shutting_down.is_set():
-                command = self.rfile.readline().strip()
+            data = self.request.recv(self.server.RECV_SIZE)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ''
 
-                # meta commands: these control the meta operations
-                # they do not drive the robot
-                if not command:
-                    self.send_output('ok', '')
-                    continue
+        if not data:
+            # the client hung up
+            self.close()
+            return
 
-                if command == 'exit':
-                    self.send_output('ok', 'done')
-                    break
+        buf = self.buffer
+        buf.extend(data)
 
-                if command == 'shutdown':
-                    self.send_output('ok', 'shutdown')
-                    self.server.shutdown()
-                    # the main thread will shut down the robot
+        try:
+            start = 0
+            while len(buf) - start >= REQUEST_HEADER.size:
+                length, = REQUEST_HEADER.unpack_from(buf, start)
+                end = start + REQUEST_HEADER.size + length
+                if len(buf) < end:
                     break
 
-                if command == 'control':
-                    if self.controller:
-                        self.send_output('ok', 'was already a controller')
-                    else:
-                        self.controller = self.server.control_lock.acquire(blocking = 0)
-                        if self.controller:
-                            self.send_output('ok', 'acquired control lock')
-                        else:
-                            self.send_output('error', 'cannot acquire control lock')
-
-                    continue
-
-                try:
-                    output = self.process_command(command)
-
-                # got an invalid command (could not parse
-                except CommandError, e:
-                    self.send_output('invalid', e.message)
-                # driver rejected the command, but not due to an error
-                except (drivers.common.ParameterError, drivers.common.StoppedError), e:
-                    self.send_output('rejected', e.message)
-                # unknown error -- send error to the client, and log the exception
-                except Exception, e:
-                    traceback.print_exc()
-                    self.send_output('error', str(e))
+                command = str(buf[start + REQUEST_HEADER.size:end]).strip()
+                start = end
+
+                if not self.handle_command(command):
+                    self.close()
+                    return
+        except socket.error:
+            self.close()
+            return
+
+        del buf[:start]
+
+    def handle_command(self, command):
+        """handles a single command; returns False to close the connection"""
+        # meta commands: these control the meta operations
+        # they do not drive the robot
+        if not command:
+            self.send(self.RESPONSE_EMPTY)
+            return True
+
+        if command == 'exit':
+            self.send(self.RESPONSE_EXIT)
+            return False
+
+        if command == 'shutdown':
+            self.send(self.RESPONSE_SHUTDOWN)
+            self.server.shutdown()
+            # the main thread will shut down the robot
+            return False
+
+        if command in self.WIRE_COMMANDS:
+            # only use msgpack if both this server and the client want it
+            self.use_msgpack = self.server.use_msgpack and command == 'wire msgpack'
+            self.send_output('ok', 'msgpack' if self.use_msgpack else 'marshal')
+            return True
+
+        if command == 'control':
+            if self.controller:
+                self.send(self.RESPONSE_WAS_CONTROLLER)
+            else:
+                if self.server.controller is None:
+                    self.server.controller = self
+                self.controller = self.server.controller is self
+                if self.controller:
+                    self.send(self.RESPONSE_CONTROLLER)
                 else:
-                    self.send_output('ok', output)
-                    self.server.last_request = time.time()
+                    self.send(self.RESPONSE_NOT_CONTROLLER)
 
-        finally:
-            output = ["%s:%s disconnected" % self.client_address]
-            if self.controller:
-                self.server.control_lock.release()
-                self.server.robot.stop()
-                output.append("; robot stopped. no more controlling client")
+            return True
+
+        try:
+            output = self.process_command(command)
+
+        # got an invalid command (could not parse
+        except CommandError, e:
+            self.send_output('invalid', e.message)
+        # driver rejected the command, but not due to an error
+        except (drivers.common.ParameterError, drivers.common.StoppedError), e:
+            self.send_output('rejected', e.message)
+        # unknown error -- send error to the client, and log the exception
+        except Exception, e:
+            logging.exception("Error running command '%s'", command)
+            self.send_output('error', str(e))
+        else:
+            if command.startswith('status'):
+                self.send_status(output)
             else:
-                output.append("; was a viewer")
+                self.send_output('ok', output)
+            self.server.last_request = time.time()
+
+        return True
 
-            print "".join(output)
+    def close(self):
+        """Closes the connection, stopping the robot if it was in control"""
+        self.server.connections.remove(self)
+
+        # try to get the last responses (like exit's) out before closing
+        if self.outgoing:
+            try:
+                self.request.send(self.outgoing)
+            except socket.error:
+                pass
+        self.request.close()
+
+        if self.controller:
+            self.server.controller = None
+            try:
+                self.server.robot.stop()
+            except Exception:
+                logging.exception("Could not stop robot after %s:%s disconnected",
+                        *self.client_address)
+            logging.info("%s:%s disconnected; robot stopped. no more controlling client",
+                    *self.client_address)
+        else:
+            logging.info("%s:%s disconnected; was a viewer", *self.client_address)
 
 class Robot(object):
     """Represents the robot this server is controlling"""
-    def __init__(self, driver, arduino_serial = None, **options):
+    def __init__(self, driver, arduino_serial = None, status_ttl = 0.1, **options):
         self.arduino_serial = arduino_serial
 
         # a real arduino is found during reset()
@@ -199,18 +499,35 @@ class Robot(object):
         self.driver = drivermod.get_driver(robot = self, **options)
 
         # make a list of sensors
-        self.sensors = {
-                'Battery voltage':sensors.VoltageSensor(self, 'BV', 100000, 10000),
-                'Driver temperature':sensors.TemperatureSensor(self, 'DT'),
-                'Left sonar':sensors.Sonar(self, 'LS'),
-                'Right sonar':sensors.Sonar(self, 'RS'),
-                'Left encoder':sensors.Encoder(self, 'LE'),
-                'Right encoder':sensors.Encoder(self, 'RE'),
-                }
+        self.sensors = dict((sensor.name, sensor) for sensor in (
+                sensors.VoltageSensor(self, 'BV', 100000, 10000, name = 'Battery voltage'),
+                sensors.TemperatureSensor(self, 'DT', name = 'Driver temperature'),
+                sensors.Sonar(self, 'LS', name = 'Left sonar'),
+                sensors.Sonar(self, 'RS', name = 'Right sonar'),
+                sensors.Encoder(self, 'LE', name = 'Left encoder'),
+                sensors.Encoder(self, 'RE', name = 'Right encoder'),
+                ))
+
+        # walked on every read and status
+        self._sensor_items = tuple(self.sensors.items())
+
+        # maps the key of each sensor to its name
+        self.sensor_keys = dict((sensor.key, name) for name, sensor in self._sensor_items)
 
         # keep track of when the last command was issued to the robot
         self.last_control = 0
 
+        # the monitor publishes a fresh status every tick, which is shared
+        # between all the connections asking for it; they only rebuild it
+        # themselves once it is status_ttl seconds old
+        self.status_ttl = status_ttl
+        self._status_cache = None
+        self._status_cache_ts = 0
+        self._status_lock = threading.Lock()
+
+        # bumped by every control command, to expire the cached status
+        self._control_count = 0
+
     def shutdown(self):
         """Stop talking to the arduino or moving"""
         try:
@@ -220,20 +537,61 @@ class Robot(object):
 
         self.arduino.stop()
 
+    def read_sensors(self):
+        """Reads every sensor against the same readings and timestamp"""
+        # the arduino only ever replaces single readings in this dict, so
+        # sharing it between the sensors is safe without copying it
+        readings = self.arduino.sensor_readings
+        now = time.time()
+
+        for name, sensor in self._sensor_items:
+            sensor.read(readings, now)
+
     @property
     def status(self):
-        """Return the status of the robot"""
-        status = {
+        """Return the status of the robot
+
+        The returned dict, and the sensor dicts in it, are shared between
+        callers, so copy them before changing them.
+        """
+        if time.time() - self._status_cache_ts < self.status_ttl:
+            return self._status_cache
+
+        with self._status_lock:
+            # somebody else may have rebuilt it while we waited for the lock
+            now = time.time()
+            if now - self._status_cache_ts >= self.status_ttl:
+                self._publish_status(now)
+
+            return self._status_cache
+
+    def refresh_status(self):
+        """Rebuilds the shared status; the monitor calls this every tick"""
+        with self._status_lock:
+            self._publish_status(time.time())
+
+    def _publish_status(self, now):
+        """Rebuilds the shared status; call with the status lock held"""
+        control_count = self._control_count
+        self._status_cache = self._build_status()
+        self._status_cache_ts = now
+
+        # don't keep a status that may predate a control command
+        if control_count != self._control_count:
+            self._status_cache_ts = 0
+
+    def _build_status(self):
+        """Builds the status of the robot from its components"""
+        return {
                 'driver':self.driver.status,
                 'arduino':self.arduino.status,
-                'sensors':[]}
-
-        for name, sensor in self.sensors.items():
-            sensor_status = sensor.status
-            sensor_status['name'] = name
-            status['sensors'].append(sensor_status)
+                'sensors':[sensor.status for name, sensor in self._sensor_items]}
 
-        return status
+    def _controlled(self):
+        """Records a control command, and expires the status so it shows it"""
+        self.last_control = time.time()
+        self._control_count += 1
+        self._status_cache_ts = 0
 
     def reset(self):
         """Reset all of the components to a known initialized state"""
@@ -246,27 +604,27 @@ class Robot(object):
         self.arduino.start_monitor()
 
         self.driver.stop()
-        self.last_control = time.time()
+        self._controlled()
 
     def go(self):
         """Puts the robot in go mode"""
         self.driver.go()
-        self.last_control = time.time()
+        self._controlled()
 
     def stop(self):
         """Stops the robot"""
         self.driver.stop()
-        self.last_control = time.time()
+        self._controlled()
 
     def brake(self, speed):
         """initiates braking"""
         self.driver.brake(speed)
-        self.last_control = time.time()
+        self._controlled()
 
     def set_speed(self, speed, motor):
         """sets the speed on one or both motors"""
         self.driver.set_speed(speed, motor)
-        self.last_control = time.time()
+        self._controlled()
 
 def main():
     """Parses command-line options and starts the robot-controlling server"""
@@ -288,6 +646,8 @@ def main():
             help="Host/address to listen on [Default: all (empty string)]")
     netgroup.add_option('-p', '--port', action="store", type="int", dest="port", default=9999,
             help="Port to listen on [Default: 9999]")
+    netgroup.add_option('-w', '--wire', action="store", type="choice", dest="wire", default="marshal", choices=['marshal', 'msgpack'],
+            help="Encode responses using this codec for clients that ask for it; pickle is used for anything it can't encode [Default: marshal]")
     parser.add_option_group(netgroup)
 
     smcgroup = OptionGroup(parser, "SMC-based driver options",
@@ -315,6 +675,10 @@ def main():
             print "Invalid driver specified: %s" % options.driver
             list_and_exit = True
 
+    if options.wire == 'msgpack' and msgpack is None:
+        print "The msgpack wire codec needs the msgpack module installed"
+        return 1
+
     # if we requested a driver list, list drivers and then exit
     if list_and_exit:
         print "Available drivers:"
@@ -325,6 +689,14 @@ def main():
 
     # otherwise, try to create the robot and then start the servers
     robot = Robot(**vars(options))
+
+    # hand the GIL around more often, so the arduino reader and the monitor
+    # aren't held up behind a connection encoding a large status
+    if hasattr(sys, 'setswitchinterval'):
+        sys.setswitchinterval(0.001)
+    else:
+        sys.setcheckinterval(10)
+
     robot.reset()
     print "Robot initialized successfully..."
 
@@ -332,9 +704,7 @@ def main():
     server = TCPServer((options.host, options.port), ConnectionHandler)
     server.last_request = 0
     server.robot = robot
-
-    # used to limit control of the robot to a single connection
-    server.control_lock = threading.RLock()
+    server.use_msgpack = options.wire == 'msgpack'
 
     # create the monitor
     server_monitor = monitor.ServerMonitor(server, robot)